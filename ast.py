@@ -9,149 +9,181 @@ def print_array(arr):
     :param arr: a list that needed to be printed
     :return: the string needed to print
     """
-    string = ''
-    for a in arr:
-        string += str(a) + ' '
-    return string.strip(' ')
+    # elements printing an empty string must not leave spaces at both ends
+    return ' '.join(map(str, arr)).strip(' ')
 
 
 class Ast:
+    __slots__ = ('parent',)
+
     def __init__(self, parent):
+        # the subclasses assign parent themselves rather than calling this through super(),
+        # the nodes are built once per term and operator, so the extra call shows up in parsing
         self.parent = parent
 
+    def __repr__(self):
+        # __str__ prints the whole subtree, repr only names the node so debugging a large AST stays cheap
+        return f'<{type(self).__name__}@{id(self):x}>'
+
 
 class BinaryExprAst(Ast):
+    __slots__ = ('operator', 'lhs', 'rhs')
+
     def __init__(self, parent: 'None', operator: 'str', lhs: 'Ast', rhs: 'Ast'):
-        super(BinaryExprAst, self).__init__(parent)
+        self.parent = parent
         self.operator = operator
         self.lhs = lhs
         self.rhs = rhs
 
     def __str__(self):
-        return '({}, {}, {})'.format(self.operator, self.lhs, self.rhs)
+        return f'({self.operator}, {self.lhs}, {self.rhs})'
 
 
 class UnaryExprAst(Ast):
+    __slots__ = ('operator', 'operand')
+
     def __init__(self, parent: 'None', operator: 'str', operand: 'Ast'):
-        super(UnaryExprAst, self).__init__(parent)
+        self.parent = parent
         self.operator = operator
         self.operand = operand
 
     def __str__(self):
-        return '({} {})'.format(self.operator, self.operand)
+        return f'({self.operator} {self.operand})'
 
 
 class CallExprAst(Ast):
+    __slots__ = ('callee', 'args')
+
     def __init__(self, parent: 'None', callee: 'str', args: 'list[ tuple(arg_name: str, arg_val: Ast) ]'):
-        super(CallExprAst, self).__init__(parent)
+        self.parent = parent
         self.callee = callee
         self.args = args
 
     def __str__(self):
-        return '({} {})'.format(self.callee, print_array(self.args))
+        return f'({self.callee} {print_array(self.args)})'
 
 
 class VariableExprAst(Ast):
+    __slots__ = ('name', 'symbol')
+
     def __init__(self, parent: 'None', name: 'str'):
-        super(VariableExprAst, self).__init__(parent)
+        self.parent = parent
         self.name = name
+        self.symbol = None  # the symbol of the variable, found by check_symbol_definition
 
     def __str__(self):
         return self.name
 
 
 class NumberExprAst(Ast):
+    __slots__ = ('value',)
+
     def __init__(self, parent: 'None', value: 'int'):
-        super(NumberExprAst, self).__init__(parent)
+        self.parent = parent
         self.value = value
 
     def __str__(self):
-        return '{}'.format(self.value)
+        return f'{self.value}'
 
 
 class VariableDeclarationAst(Ast):
+    __slots__ = ('name', 'type')
+
     def __init__(self, parent: 'None', name: 'str', var_type: 'str'):
-        super(VariableDeclarationAst, self).__init__(parent)
+        self.parent = parent
         self.name = name
         self.type = var_type
 
     def __str__(self):
-        return '(var {}:{})'.format(self.name, self.type)
+        return f'(var {self.name}:{self.type})'
 
 
 class FunctionDeclarationAst(Ast):
+    __slots__ = ('name', 'args', 'return_type', 'body')
+
     def __init__(self, parent: 'None', name: 'str',
                  args: 'list[ tuple(arg_name:str, arg_type:str) ]',
                  return_type: 'str',
                  body: 'FunctionBodyAst'):
-        super(FunctionDeclarationAst, self).__init__(parent)
+        self.parent = parent
         self.name = name
         self.args = args
         self.return_type = return_type
         self.body = body
 
     def __str__(self):
-        return '({}({})->{} {})'.format(self.name, print_array(self.args), self.return_type, self.body)
+        return f'({self.name}({print_array(self.args)})->{self.return_type} {self.body})'
 
 
 class ReturnStatementAst(Ast):
+    __slots__ = ('value',)
+
     def __init__(self, parent: 'None', value: 'Ast'):
-        super(ReturnStatementAst, self).__init__(parent)
+        self.parent = parent
         self.value = value
 
     def __str__(self):
-        return '(return {})'.format(self.value)
+        return f'(return {self.value})'
 
 
 class IfStatementAst(Ast):
+    __slots__ = ('condition', 'then_block', 'else_block')
+
     def __init__(self, parent: 'None', condition: 'Ast', then_block: 'StatementAst', else_block: 'StatementAst'):
-        super(IfStatementAst, self).__init__(parent)
+        self.parent = parent
         self.condition = condition
         self.then_block = then_block
         self.else_block = else_block
 
     def __str__(self):
-        return '(if {} {} {})'.format(self.condition, self.then_block, self.else_block)
+        return f'(if {self.condition} {self.then_block} {self.else_block})'
 
 
 class WhileStatementAst(Ast):
+    __slots__ = ('condition', 'loop_block')
+
     def __init__(self, parent: 'None', condition: 'Ast', loop_block: 'StatementAst'):
-        super(WhileStatementAst, self).__init__(parent)
+        self.parent = parent
         self.condition = condition
-        self.condition.parent = condition
         self.loop_block = loop_block
 
     def __str__(self):
-        return '(while {} {})'.format(self.condition, self.loop_block)
+        return f'(while {self.condition} {self.loop_block})'
 
 
 class StatementAst(Ast):
+    __slots__ = ('statements',)
+
     def __init__(self, parent: 'None',
                  statements: '[Ast]'):
-        super(StatementAst, self).__init__(parent)
+        self.parent = parent
         self.statements = statements
 
     def __str__(self):
-        return '{}'.format(print_array(self.statements))
+        return print_array(self.statements)
 
 
 class FunctionBodyAst(Ast):
+    __slots__ = ('var_declaration', 'statements')
+
     def __init__(self, parent: 'None',
                  var_declaration: '[VariableDeclarationAst]', statements: '[StatementAst]'):
-        super(FunctionBodyAst, self).__init__(parent)
+        self.parent = parent
         self.var_declaration = var_declaration
         self.statements = statements
 
     def __str__(self):
-        return '({} {})'.format(print_array(self.var_declaration), print_array(self.statements))
+        return f'({print_array(self.var_declaration)} {print_array(self.statements)})'
 
 
 class GlobalDeclarationAst(Ast):
+    __slots__ = ('var_declaration', 'func_declaration')
+
     def __init__(self, parent: 'None',
                  var_declaration: '[VariableDeclarationAst]', func_declaration: '[FunctionDeclarationAst]'):
-        super(GlobalDeclarationAst, self).__init__(parent)
+        self.parent = parent
         self.var_declaration = var_declaration
         self.func_declaration = func_declaration
 
     def __str__(self):
-        return '({} {})'.format(print_array(self.var_declaration), print_array(self.func_declaration))
+        return f'({print_array(self.var_declaration)} {print_array(self.func_declaration)})'
@@ -9,364 +9,525 @@ from vmachine import *
 from resolve_symbol import *
 from ast import *
 
-text_seg_ptr = 0  # the pointer pointing to the next empty position in the text segment
-data_seg_ptr = 0  # the pointer pointing to the next empty position in the data segment
+
+class CodegenContext:
+    """
+    The state of the code generation, it's passed to every code generator
+    """
+    __slots__ = ('text', 'text_ptr', 'data_ptr', 'pending_calls', 'labels')
+
+    def __init__(self, text=text_seg):
+        self.text = text  # the segment storing the generated code, the text segment of the virtual machine by default
+        self.text_ptr = 0  # the pointer pointing to the next empty position in the text segment
+        self.data_ptr = 0  # the pointer pointing to the next empty position in the data segment
+        self.pending_calls = {}  # maps the positions of the call placeholders to the callee names, for the linker
+        self.labels = []  # the positions of the jump slots and loop entries waiting for their jump instructions
+
+
+'''
+the instructions emitted for each binary operator after the operands are generated
+the encodings are constant, so they are computed once here
+for && operation we first multiplies the two operand and check whether the result is zero or not
+for || operation we first performs a bitwise or and check whether the result is zero or not
+'''
+binary_operations = {
+    '*': (gen_mul(),),
+    '/': (gen_div(),),
+    '%': (gen_mod(),),
+    '+': (gen_add(),),
+    '-': (gen_sub(),),
+    '<<': (gen_shl(),),
+    '>>': (gen_shr(),),
+    '>': (gen_gt(),),
+    '>=': (gen_ge(),),
+    '<': (gen_lt(),),
+    '<=': (gen_le(),),
+    '==': (gen_eq(),),
+    '!=': (gen_ne(),),
+    '&': (gen_andb(),),
+    '^': (gen_xorb(),),
+    '|': (gen_orb(),),
+    '&&': (gen_mul(), gen_push(rzero), gen_ne()),
+    '||': (gen_orb(), gen_push(rzero), gen_ne())
+}
+
+'''
+the instructions emitted for each unary operator after the operand is generated
+'''
+unary_operations = {
+    '!': (gen_push(rzero), gen_eq()),
+    '~': (gen_push(rax), gen_notb()),
+    '-': (gen_push(rzero), gen_sub())
+}
+
+'''
+the encodings of the builtin functions, the calls to them are linked to these instructions directly
+'''
+builtin_functions = {
+    'print': gen_outpt(),
+    'input': gen_inpt(),
+    'exit': gen_iexit()
+}
+
+'''
+the memoized encodings of lea rax, <value>, mapping the value of a number literal to its encoding
+'''
+number_encodings = {}
+
+
+def grow_text(ctx):
+    """
+    Doubles the size of the text segment, this is called when the text segment is full
+    the list is extended in place, so the virtual machine still sees the same text segment
+    :param ctx: the code generation context
+    :return: None
+    """
+    ctx.text.extend([0] * (len(ctx.text) or text_segment_size))
 
 
-def push_instruction(instr):
+def push_instruction(ctx, instr):
     """
     Push an instruction to the text segment and move the text segment pointer forward by 1
+    :param ctx: the code generation context
     :param instr: the encoding of the instruction needed to insert
     :return: None
     """
-    global text_seg_ptr
-    text_seg[text_seg_ptr] = instr
-    text_seg_ptr += 1
+    try:
+        ctx.text[ctx.text_ptr] = instr
+    except IndexError:
+        grow_text(ctx)
+        ctx.text[ctx.text_ptr] = instr
+    ctx.text_ptr += 1
 
 
-def generate_code(current_ast, current_symbol_table=symbol_table, var_num=0):
+def emit_placeholder(ctx, callee):
     """
-    Generates the target code for the current AST,
-    the generated code will be automatically stored in the virtual machine's corresponding segments
-    :param current_ast: the current AST needed to generate code
-    :param current_symbol_table: the symbol table for the current context
-    :param var_num: for function code generation, records the number of local variables inside the function,
-    this is used for stack unwinding before the function return
-    :return: None, all generated codes are stored in the text segment of the virtual machine
+    Push a placeholder of the call instruction to the text segment and record the name of the callee,
+    the placeholder will be replaced by the real call instruction in link_function
+    only integers are stored in the text segment, the callee name is kept in ctx.pending_calls
+    :param ctx: the code generation context
+    :param callee: the name of the function being called
+    :return: None
     """
-    global text_seg_ptr
-    global data_seg_ptr
-    if isinstance(current_ast, BinaryExprAst):
-        op = current_ast.operator
-        if op == '=':
-            """
-            the assignment 
-            we treat the assignment operator to be the same as all other operators 
-            and it doesn't return anything (returns some unexpected value)
-            using assignment multiple times in one line may cause mistakes 
-            please only use assignment at most once inside one line, this is very important
-            """
-            if isinstance(current_ast.lhs, VariableExprAst):
-                # parse assignment
-                if current_ast.lhs.name in current_symbol_table.symbols:
-                    # local variable
-                    """
-                    lea rax, <position>(rbp) 
-                    push rax 
-                    <generated code for expression>
-                    si 
-                    """
-                    position = current_symbol_table.symbols[current_ast.lhs.name].position
-                    push_instruction(gen_lea(rax, rbp, position))
-                    push_instruction(gen_push(rax))
-                    generate_code(current_ast.rhs, current_symbol_table, var_num)
-                    push_instruction(gen_si())
-                    pass
-                elif current_ast.lhs.name in symbol_table.symbols:
-                    # global variable
-                    """
-                    lea rax, <position>
-                    push rax
-                    <generated code for expression>
-                    sid
-                    """
-                    position = symbol_table.symbols[current_ast.lhs.name].position
-                    push_instruction(gen_lea(rax, rzero, position))
-                    push_instruction(gen_push(rax))
-                    generate_code(current_ast.rhs, current_symbol_table, var_num)
-                    push_instruction(gen_sid())
-                    pass
-                else:
-                    raise ValueError('error in codegen: variable {} not found'.format(current_ast.lhs.name))
-                pass
-            else:
-                raise ValueError('rvalue assignment')
-            return
+    ctx.pending_calls[ctx.text_ptr] = callee
+    push_instruction(ctx, gen_call(0))  # the address is unknown until every function is generated
 
-        # below is the common binary operations
-        """
-        <generated code for LHS>
-        # note that the result will be saved on rax after running <generated code for LHS> 
-        push rax
-        <generated code for RHS>
-        <operation>
-        """
-        generate_code(current_ast.lhs, current_symbol_table, var_num)
-        push_instruction(gen_push(rax))
-        generate_code(current_ast.rhs, current_symbol_table, var_num)
-        if op == '*':
-            push_instruction(gen_mul())
-            pass
-        elif op == '/':
-            push_instruction(gen_div())
-            pass
-        elif op == '%':
-            push_instruction(gen_mod())
-            pass
-        elif op == '+':
-            push_instruction(gen_add())
-            pass
-        elif op == '-':
-            push_instruction(gen_sub())
-            pass
-        elif op == '<<':
-            push_instruction(gen_shl())
-            pass
-        elif op == '>>':
-            push_instruction(gen_shr())
-            pass
-        elif op == '>':
-            push_instruction(gen_gt())
-            pass
-        elif op == '>=':
-            push_instruction(gen_ge())
-            pass
-        elif op == '<':
-            push_instruction(gen_lt())
-            pass
-        elif op == '<=':
-            push_instruction(gen_le())
-            pass
-        elif op == '==':
-            push_instruction(gen_eq())
-            pass
-        elif op == '!=':
-            push_instruction(gen_ne())
-            pass
-        elif op == '&':
-            push_instruction(gen_andb())
-            pass
-        elif op == '^':
-            push_instruction(gen_xorb())
-            pass
-        elif op == '|':
-            push_instruction(gen_orb())
-            pass
-        elif op == '&&':
-            """
-            for && operation we first multiplies the two operand and check whether the result is zero or not 
-            """
-            push_instruction(gen_mul())
-            push_instruction(gen_push(rzero))
-            push_instruction(gen_ne())
-            pass
-        elif op == '||':
-            """
-            for || operation we first performs a bitwise or and check whether the result is zero or not 
-            """
-            push_instruction(gen_orb())
-            push_instruction(gen_push(rzero))
-            push_instruction(gen_ne())
-            pass
 
-        pass
-    elif isinstance(current_ast, UnaryExprAst):
-        """
-        <generated code for operand>
-        push rax or rzero 
-        <operation>
-        """
-        op = current_ast.operator
-        generate_code(current_ast.operand, current_symbol_table, var_num)
-        if op == '!':
-            push_instruction(gen_push(rzero))
-            push_instruction(gen_eq())
-            pass
-        elif op == '~':
-            push_instruction(gen_push(rax))
-            push_instruction(gen_notb())
-            pass
-        elif op == '-':
-            push_instruction(gen_push(rzero))
-            push_instruction(gen_sub())
-            pass
-        pass
-    elif isinstance(current_ast, CallExprAst):
+def _push_node(work, current_ast, current_symbol_table, var_num):
+    """
+    Schedule the code generation of an AST node on the work stack
+    the nodes without a code generator (e.g. None for an empty else block) generate nothing, so they are not scheduled
+    :param work: the work stack of generate_code
+    :param current_ast: the AST node needed to generate code
+    :param current_symbol_table: the symbol table for the context of the node
+    :param var_num: the number of local variables of the enclosing function
+    :return: None
+    """
+    code_generator = code_generators.get(type(current_ast))
+    if code_generator is not None:
+        work.append((code_generator, current_ast, current_symbol_table, var_num))
+
+
+def _gen_binary_expression(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for BinaryExprAst, including the assignment
+    """
+    op = current_ast.operator
+    if op == '=':
         """
-        for each argument 
-            <generated code for the argument value>
-            push rax
-        
-        call <callee>
-        lea rsp, -<number of arguments>(rsp)  # stack unwind for arguments 
+        the assignment
+        we treat the assignment operator to be the same as all other operators
+        and it doesn't return anything (returns some unexpected value)
+        using assignment multiple times in one line may cause mistakes
+        please only use assignment at most once inside one line, this is very important
         """
-        for i in range(len(current_ast.args)):
-            generate_code(current_ast.args[i][1], current_symbol_table, var_num)
-            push_instruction(gen_push(rax))  # push arguments
-        text_seg[text_seg_ptr] = current_ast.callee  # call instructions are generated in the next stage
-        text_seg_ptr += 1
-        push_instruction(gen_lea(rsp, rsp, -len(current_ast.args)))  # stack unwind for arguments
-        pass
-    elif isinstance(current_ast, VariableExprAst):
-        if current_ast.name in current_symbol_table.symbols:
-            # local variable
-            """
-            lea rax, <position>(rbp)
-            push rax 
-            li 
-            """
-            position = current_symbol_table.symbols[current_ast.name].position
-            push_instruction(gen_lea(rax, rbp, position))
-            push_instruction(gen_push(rax))
-            push_instruction(gen_li())
-            pass
-        elif current_ast.name in symbol_table.symbols:
-            # global variable
-            """
-            lea rax, <position>
-            push rax
-            lid 
-            """
-            position = symbol_table.symbols[current_ast.name].position
-            push_instruction(gen_lea(rax, rzero, position))
-            push_instruction(gen_push(rax))
-            push_instruction(gen_lid())
+        if type(current_ast.lhs) is VariableExprAst:
+            # parse assignment
+            name = current_ast.lhs.name
+            symbol = current_ast.lhs.symbol  # found by check_symbol_definition
+            if symbol is None:
+                raise ValueError('error in codegen: variable {} not found'.format(name))
+            if not symbol.is_global:
+                # local variable
+                """
+                lea rax, <position>(rbp)
+                push rax
+                <generated code for expression>
+                si
+                """
+                push_instruction(ctx, gen_lea(rax, rbp, symbol.position))
+                push_instruction(ctx, gen_push(rax))
+                work.append(gen_si())
+                _push_node(work, current_ast.rhs, current_symbol_table, var_num)
+                pass
+            else:
+                # global variable
+                """
+                lea rax, <position>
+                push rax
+                <generated code for expression>
+                sid
+                """
+                push_instruction(ctx, gen_lea(rax, rzero, symbol.position))
+                push_instruction(ctx, gen_push(rax))
+                work.append(gen_sid())
+                _push_node(work, current_ast.rhs, current_symbol_table, var_num)
+                pass
             pass
         else:
-            raise ValueError('error in codegen: variable declaration for {} not found'.format(current_ast.name))
+            raise ValueError('rvalue assignment')
+        return
 
-        pass
-    elif isinstance(current_ast, NumberExprAst):
-        """
-        lea rax, <value>
-        """
-        push_instruction(gen_lea(rax, rzero, current_ast.value))
-        pass
-    elif isinstance(current_ast, VariableDeclarationAst):
-        if current_symbol_table == symbol_table:
-            current_symbol_table.symbols[current_ast.name].position = data_seg_ptr
-            data_seg_ptr += 1
-        else:
-            # local variable
-            # we don't generate code for local variable here, we should generate code while parsing FunctionBodyAst
-            raise ValueError('error in codegen: local variables are already resolved in function body')
-        pass
-    elif isinstance(current_ast, FunctionDeclarationAst):
-        """
-        push rbp
-        lea rsp, 0(rbp)
-        <generated code for function body> # this also contains the stack unwinding 
-        pop rbp
-        ret 
-        """
-        current_symbol_table.symbols[current_ast.name].position = text_seg_ptr
-        local_symbol_table = current_symbol_table.children[current_ast.name]
-        """
-        calculate the position of each parameter, note that the parameters are pushed from left to right 
-        """
-        for i in range(len(current_ast.args)):
-            local_symbol_table.symbols[current_ast.args[i][0]].position = -2 - len(current_ast.args) + i
-        push_instruction(gen_push(rbp))
-        push_instruction(gen_lea(rbp, rsp, 0))
-        generate_code(current_ast.body, current_symbol_table.children[current_ast.name], var_num)
-        push_instruction(gen_pop(rbp))
-        push_instruction(gen_ret())
+    # below is the common binary operations
+    """
+    <generated code for LHS>
+    # note that the result will be saved on rax after running <generated code for LHS>
+    push rax
+    <generated code for RHS>
+    <operation>
+    """
+    # the work stack is last in first out, so everything is scheduled in the reversed order
+    work.extend(reversed(binary_operations[op]))
+    _push_node(work, current_ast.rhs, current_symbol_table, var_num)
+    work.append(gen_push(rax))
+    _push_node(work, current_ast.lhs, current_symbol_table, var_num)
+    pass
 
-        pass
-    elif isinstance(current_ast, ReturnStatementAst):
-        """
-        <generated code for return value>
-        lea rsp, -<var_num>(rsp) 
-        pop rbp
-        ret 
-        """
-        generate_code(current_ast.value, current_symbol_table, var_num)
-        push_instruction(gen_lea(rsp, rsp, -var_num))
-        push_instruction(gen_pop(rbp))
-        push_instruction(gen_ret())
-        pass
-    elif isinstance(current_ast, IfStatementAst):
+
+def _gen_unary_expression(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for UnaryExprAst
+    <generated code for operand>
+    push rax or rzero
+    <operation>
+    """
+    work.extend(reversed(unary_operations[current_ast.operator]))
+    _push_node(work, current_ast.operand, current_symbol_table, var_num)
+    pass
+
+
+def _gen_call_expression(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for CallExprAst
+    for each argument
+        <generated code for the argument value>
+        push rax
+
+    call <callee>
+    lea rsp, -<number of arguments>(rsp)  # stack unwind for arguments
+    """
+    args = current_ast.args
+    work.append(gen_lea(rsp, rsp, -len(args)))  # stack unwind for arguments
+    work.append(current_ast.callee)  # call instructions are generated in the next stage
+    for arg_name, arg_val in reversed(args):
+        work.append(gen_push(rax))  # push arguments
+        _push_node(work, arg_val, current_symbol_table, var_num)
+    pass
+
+
+def _gen_variable_expression(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for VariableExprAst, which loads the value of the variable to rax
+    """
+    name = current_ast.name
+    symbol = current_ast.symbol  # found by check_symbol_definition
+    if symbol is None:
+        raise ValueError('error in codegen: variable declaration for {} not found'.format(name))
+    if not symbol.is_global:
+        # local variable
         """
-            <condition>
-            jz false
-            <then_block>
-            jmp exit
-        false: 
-            <else_block>
-        exit: 
+        lea rax, <position>(rbp)
+        push rax
+        li
         """
-        generate_code(current_ast.condition, current_symbol_table, var_num)
-        jz_false = text_seg_ptr
-        text_seg_ptr += 1
-        generate_code(current_ast.then_block, current_symbol_table, var_num)
-        jmp_exit = text_seg_ptr
-        text_seg_ptr += 1
-        text_seg[jz_false] = gen_jz(text_seg_ptr)
-        generate_code(current_ast.else_block, current_symbol_table, var_num)
-        text_seg[jmp_exit] = gen_jmp(text_seg_ptr)
+        push_instruction(ctx, gen_lea(rax, rbp, symbol.position))
+        push_instruction(ctx, gen_push(rax))
+        push_instruction(ctx, gen_li())
         pass
-    elif isinstance(current_ast, WhileStatementAst):
+    else:
+        # global variable
         """
-        loop: 
-            <condition>
-            jz exit
-            <loop_block>
-            jmp loop
-        exit: 
+        lea rax, <position>
+        push rax
+        lid
         """
-        loop_begin = text_seg_ptr
-        generate_code(current_ast.condition, current_symbol_table, var_num)
-        jz_exit = text_seg_ptr
-        text_seg_ptr += 1
-        generate_code(current_ast.loop_block, current_symbol_table, var_num)
-        push_instruction(gen_jmp(loop_begin))
-        text_seg[jz_exit] = gen_jz(text_seg_ptr)
+        push_instruction(ctx, gen_lea(rax, rzero, symbol.position))
+        push_instruction(ctx, gen_push(rax))
+        push_instruction(ctx, gen_lid())
         pass
-    elif isinstance(current_ast, StatementAst):
-        for statement in current_ast.statements:
-            generate_code(statement, current_symbol_table, var_num)
-        pass
-    elif isinstance(current_ast, FunctionBodyAst):
-        """
-        lea rsp, var_num(rsp) # allocate space for local variables 
-        <statements>
-        lea rsp, -var_num(rsp) # stack unwind for local variables 
-        """
-        var_num = len(current_ast.var_declaration)
-        push_instruction(gen_lea(rsp, rsp, var_num))
-        for i in range(var_num):
-            current_symbol_table.symbols[current_ast.var_declaration[i].name].position = i
 
-        for statement in current_ast.statements:
-            generate_code(statement, current_symbol_table, var_num)
+    pass
 
-        push_instruction(gen_lea(rsp, rsp, -var_num))
-        pass
-    elif isinstance(current_ast, GlobalDeclarationAst):
-        for i in range(len(current_ast.var_declaration)):
-            generate_code(current_ast.var_declaration[i], current_symbol_table, var_num)
 
-        for i in range(len(current_ast.func_declaration)):
-            generate_code(current_ast.func_declaration[i], current_symbol_table, var_num)
-        pass
+def _gen_number_expression(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for NumberExprAst
+    lea rax, <value>
+    """
+    # the same literals appear again and again, so the encodings are memoized
+    encoding = number_encodings.get(current_ast.value)
+    if encoding is None:
+        encoding = gen_lea(rax, rzero, current_ast.value)
+        number_encodings[current_ast.value] = encoding
+    push_instruction(ctx, encoding)
+    pass
+
+
+def _gen_variable_declaration(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Allocates the space in the data segment for a global variable
+    """
+    if current_symbol_table is symbol_table:
+        current_symbol_table.symbols[current_ast.name].position = ctx.data_ptr
+        ctx.data_ptr += 1
     else:
-        pass
+        # local variable
+        # we don't generate code for local variable here, we should generate code while parsing FunctionBodyAst
+        raise ValueError('error in codegen: local variables are already resolved in function body')
+    pass
+
+
+def _gen_function_declaration(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for FunctionDeclarationAst
+    push rbp
+    lea rsp, 0(rbp)
+    <generated code for function body> # this also contains the stack unwinding
+    pop rbp
+    ret
+    """
+    current_symbol_table.symbols[current_ast.name].position = ctx.text_ptr
+    local_symbol_table = current_symbol_table.children[current_ast.name]
+    """
+    calculate the position of each parameter, note that the parameters are pushed from left to right
+    """
+    args = current_ast.args
+    local_symbols = local_symbol_table.symbols
+    first_position = -2 - len(args)
+    for i, (arg_name, arg_type) in enumerate(args):
+        local_symbols[arg_name].position = first_position + i
+    push_instruction(ctx, gen_push(rbp))
+    push_instruction(ctx, gen_lea(rbp, rsp, 0))
+    work.append(gen_ret())
+    work.append(gen_pop(rbp))
+    _push_node(work, current_ast.body, local_symbol_table, var_num)
+
+    pass
+
+
+def _gen_return_statement(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for ReturnStatementAst
+    <generated code for return value>
+    lea rsp, -<var_num>(rsp)
+    pop rbp
+    ret
+    """
+    work.append(gen_ret())
+    work.append(gen_pop(rbp))
+    work.append(gen_lea(rsp, rsp, -var_num))
+    _push_node(work, current_ast.value, current_symbol_table, var_num)
+    pass
+
+
+def _gen_jump_slot(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Reserves a slot in the text segment for a jump instruction whose target is not known yet,
+    the position of the slot is pushed to ctx.labels and the slot is filled in when the target is generated
+    """
+    if ctx.text_ptr == len(ctx.text):
+        grow_text(ctx)
+    ctx.labels.append(ctx.text_ptr)
+    ctx.text_ptr += 1
+
+
+def _gen_if_statement(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for IfStatementAst
+        <condition>
+        jz false
+        <then_block>
+        jmp exit
+    false:
+        <else_block>
+    exit:
+    """
+    work.append((_gen_if_exit, current_ast, current_symbol_table, var_num))
+    _push_node(work, current_ast.else_block, current_symbol_table, var_num)
+    work.append((_gen_if_false, current_ast, current_symbol_table, var_num))
+    _push_node(work, current_ast.then_block, current_symbol_table, var_num)
+    work.append((_gen_jump_slot, current_ast, current_symbol_table, var_num))
+    _push_node(work, current_ast.condition, current_symbol_table, var_num)
+    pass
+
+
+def _gen_if_false(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Reserves the slot of jmp exit after the then block and fills in the jz false before the then block
+    """
+    jz_false = ctx.labels.pop()
+    _gen_jump_slot(ctx, work, current_ast, current_symbol_table, var_num)
+    ctx.text[jz_false] = gen_jz(ctx.text_ptr)
+    pass
+
+
+def _gen_if_exit(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Fills in the jmp exit after the then block
+    """
+    jmp_exit = ctx.labels.pop()
+    ctx.text[jmp_exit] = gen_jmp(ctx.text_ptr)
+    pass
+
+
+def _gen_while_statement(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for WhileStatementAst
+    loop:
+        <condition>
+        jz exit
+        <loop_block>
+        jmp loop
+    exit:
+    """
+    ctx.labels.append(ctx.text_ptr)  # loop
+    work.append((_gen_while_exit, current_ast, current_symbol_table, var_num))
+    _push_node(work, current_ast.loop_block, current_symbol_table, var_num)
+    work.append((_gen_jump_slot, current_ast, current_symbol_table, var_num))
+    _push_node(work, current_ast.condition, current_symbol_table, var_num)
+    pass
+
+
+def _gen_while_exit(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the jmp loop after the loop block and fills in the jz exit before the loop block
+    """
+    jz_exit = ctx.labels.pop()
+    loop_begin = ctx.labels.pop()
+    push_instruction(ctx, gen_jmp(loop_begin))
+    ctx.text[jz_exit] = gen_jz(ctx.text_ptr)
+    pass
+
+
+def _gen_statement(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for each statement inside the StatementAst
+    """
+    for statement in reversed(current_ast.statements):
+        _push_node(work, statement, current_symbol_table, var_num)
+    pass
+
+
+def _gen_function_body(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for FunctionBodyAst
+    lea rsp, var_num(rsp) # allocate space for local variables
+    <statements>
+    lea rsp, -var_num(rsp) # stack unwind for local variables
+    """
+    var_declaration = current_ast.var_declaration
+    var_num = len(var_declaration)
+    push_instruction(ctx, gen_lea(rsp, rsp, var_num))
+    local_symbols = current_symbol_table.symbols
+    for i, var_ast in enumerate(var_declaration):
+        local_symbols[var_ast.name].position = i
+
+    work.append(gen_lea(rsp, rsp, -var_num))
+    for statement in reversed(current_ast.statements):
+        _push_node(work, statement, current_symbol_table, var_num)
+    pass
+
+
+def _gen_global_declaration(ctx, work, current_ast, current_symbol_table, var_num):
+    """
+    Generates the target code for the global variable declarations and the function declarations
+    """
+    # the variable declarations are generated first, so the global variables are allocated before they're referenced
+    for declaration_ast in reversed(current_ast.var_declaration + current_ast.func_declaration):
+        _push_node(work, declaration_ast, current_symbol_table, var_num)
+    pass
+
+
+'''
+the code generator of each type of AST node
+the dispatch is a single dictionary lookup on the exact type of the node,
+which is cheaper than an isinstance chain or a match statement with class patterns,
+both of them test the cases one by one
+'''
+code_generators = {
+    BinaryExprAst: _gen_binary_expression,
+    UnaryExprAst: _gen_unary_expression,
+    CallExprAst: _gen_call_expression,
+    VariableExprAst: _gen_variable_expression,
+    NumberExprAst: _gen_number_expression,
+    VariableDeclarationAst: _gen_variable_declaration,
+    FunctionDeclarationAst: _gen_function_declaration,
+    ReturnStatementAst: _gen_return_statement,
+    IfStatementAst: _gen_if_statement,
+    WhileStatementAst: _gen_while_statement,
+    StatementAst: _gen_statement,
+    FunctionBodyAst: _gen_function_body,
+    GlobalDeclarationAst: _gen_global_declaration
+}
+
+
+def generate_code(ctx, current_ast, current_symbol_table=symbol_table, var_num=0):
+    """
+    Generates the target code for the current AST,
+    the generated code will be automatically stored in the virtual machine's corresponding segments
+    the AST is traversed with an explicit work stack instead of recursion, so deeply nested code won't hit the
+    recursion limit. each entry of the work stack is one of:
+        (code_generator, AST node, symbol table, var_num): run the code generator,
+        which may schedule more entries
+        an integer: the encoding of an instruction to push
+        a string: the name of a callee, a call placeholder is pushed
+    :param ctx: the code generation context
+    :param current_ast: the current AST needed to generate code
+    :param current_symbol_table: the symbol table for the current context
+    :param var_num: for function code generation, records the number of local variables inside the function,
+    this is used for stack unwinding before the function return
+    :return: None, all generated codes are stored in the text segment of the virtual machine
+    """
+    work = []
+    _push_node(work, current_ast, current_symbol_table, var_num)
+    pop_work = work.pop  # bound once, this loop runs for every node and every scheduled instruction
+    text = ctx.text
+    while work:
+        item = pop_work()
+        item_type = type(item)
+        if item_type is int:
+            # push_instruction inlined
+            try:
+                text[ctx.text_ptr] = item
+            except IndexError:
+                grow_text(ctx)
+                text[ctx.text_ptr] = item
+            ctx.text_ptr += 1
+        elif item_type is str:
+            emit_placeholder(ctx, item)
+        else:
+            code_generator, current_ast, current_symbol_table, var_num = item
+            code_generator(ctx, work, current_ast, current_symbol_table, var_num)
 
 
-def link_function():
+def link_function(ctx):
     """
     Links every function call to the real function address
+    :param ctx: the code generation context
     :return: None
     """
-    for i in range(len(text_seg)):
-        if text_seg[i] == 0:
-            return
-        if isinstance(text_seg[i], str):
-            if text_seg[i] == 'print':
-                text_seg[i] = gen_outpt()
-                continue
-            elif text_seg[i] == 'input':
-                text_seg[i] = gen_inpt()
-                continue
-            elif text_seg[i] == 'exit':
-                text_seg[i] = gen_iexit()
-                continue
-            text_seg[i] = gen_call(symbol_table.symbols[text_seg[i]].position)
+    # only the placeholders recorded by emit_placeholder need to be linked
+    for i, callee in ctx.pending_calls.items():
+        encoding = builtin_functions.get(callee)
+        if encoding is None:
+            encoding = gen_call(symbol_table.symbols[callee].position)
+        ctx.text[i] = encoding
+    ctx.pending_calls.clear()
 
 
 # tests for code generation
 if __name__ == '__main__':
-    file = open('test_parser.txt', 'r')
+    file = open('test_parser.txt', 'rb')
     lex = Lexer(file)
     parser = Parser(lex)
     ast = parser.parse_program()
@@ -374,10 +535,11 @@ if __name__ == '__main__':
     # below are generating the target code
     check_function_definition(ast)
     check_symbol_definition(ast, symbol_table)
-    push_instruction('main')
-    push_instruction(gen_iexit())
-    generate_code(ast, symbol_table)
-    link_function()
+    ctx = CodegenContext()
+    emit_placeholder(ctx, 'main')
+    push_instruction(ctx, gen_iexit())
+    generate_code(ctx, ast, symbol_table)
+    link_function(ctx)
     # up to now the target code is generated
     print_text()  # prints the assembly
     run_vm()  # runs the program
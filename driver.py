@@ -18,7 +18,7 @@ if __name__ == '__main__':
         formatter_class=argparse.RawTextHelpFormatter)
 
     parser.add_argument('code_file',
-                        type=argparse.FileType('r'))
+                        type=argparse.FileType('rb'))
 
     parser.add_argument('--dump-ast',
                         help='dump the AST',
@@ -41,10 +41,11 @@ if __name__ == '__main__':
         if args.ast_dump and not args.assembly_dump:
             print(ast)
             exit(0)
-        push_instruction('main')  # the entry point is the main function
-        push_instruction(gen_iexit())  # when the main function returns, then the program will exit
-        generate_code(ast, symbol_table)
-        link_function()
+        ctx = CodegenContext()
+        emit_placeholder(ctx, 'main')  # the entry point is the main function
+        push_instruction(ctx, gen_iexit())  # when the main function returns, then the program will exit
+        generate_code(ctx, ast, symbol_table)
+        link_function(ctx)
         if args.ast_dump:
             print(ast)
         if args.assembly_dump:
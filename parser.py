@@ -28,37 +28,37 @@ from ast import *
 from language_basis import *
 
 
-def match(token: 'Int', lexer: 'Lexer') -> 'throws ValueError':
+def match(token: 'Int', parser: 'Parser') -> 'throws ValueError':
     """
     Match a specific type of classification of the next token, if match, it returns the value of the token
     otherwise it will throw a ValueError
     :param token: the classification of the expected token, note that it's not the value
                     for matching the value of the token, please use the match_val function
-    :param lexer: the lexer you want to get token from
+    :param parser: the parser you want to get token from
     :return: the value of the matched token, or raise ValueError if mismatch
     """
-    if lexer.current_token.classification == token:
-        token = lexer.current_token
-        lexer.next_token()
-        return token.value
+    current_token = parser.tokens[parser.pos]
+    if current_token.classification == token:
+        parser.pos += 1
+        return current_token.value
     else:
-        raise ValueError('Token mismatch, expected: {}, got: {}'.format(token, lexer.current_token.value))
+        raise ValueError('Token mismatch, expected: {}, got: {}'.format(token, current_token.value))
 
 
-def match_val(token_val: 'str', lexer: 'Lexer') -> 'throws ValueError':
+def match_val(token_val: 'str', parser: 'Parser') -> 'throws ValueError':
     """
     Match a specific value of the next token, if match, it returns the value of the token
     otherwise it will throw a ValueError
     :param token_val: the value of the token needed to match, this is a string
-    :param lexer: the lexer you want to get token from
+    :param parser: the parser you want to get token from
     :return: the value of the matched token, if mismatch, it will throw a ValueError
     """
-    if lexer.current_token.value == token_val:
-        token = lexer.current_token
-        lexer.next_token()
-        return token.value
+    current_token = parser.tokens[parser.pos]
+    if current_token.value == token_val:
+        parser.pos += 1
+        return current_token.value
     else:
-        raise ValueError('Token value mismatch, expected: {}, got: {}'.format(token_val, lexer.current_token.value))
+        raise ValueError('Token value mismatch, expected: {}, got: {}'.format(token_val, current_token.value))
 
 
 class Parser:
@@ -69,6 +69,8 @@ class Parser:
 
     def __init__(self, lexer):
         self.lexer = lexer  # the lexer you want to get tokens from
+        self.tokens = None  # all tokens of the program ending with end_token, lexed by parse_program
+        self.pos = 0  # the index of the current token in self.tokens
         self.text_ptr = 0  # the pointer pointing to the text segment, not used currently
 
     def parse_number_expression(self, parent: "None") -> 'throws ValueError':
@@ -77,11 +79,12 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but not used this time
         :return: NumberExprAst if no error, otherwise it will throw ValueError
         """
-        if self.lexer.current_token.classification != Num:
-            raise ValueError('error in parsing: expected a number but got {}'.format(self.lexer.current_token.value))
+        token = self.tokens[self.pos]
+        if token.classification != Num:
+            raise ValueError('error in parsing: expected a number but got {}'.format(token.value))
         else:
-            number_ast = NumberExprAst(None, self.lexer.current_token.value)
-            self.lexer.next_token()  # eat number
+            number_ast = NumberExprAst(None, token.value)
+            self.pos += 1  # eat number
             return number_ast
 
     def parse_variable_expression(self, parent: 'None') -> 'throws ValueError':
@@ -90,12 +93,13 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: VariableExprAst if no error, otherwise it will throw ValueError
         """
-        if self.lexer.current_token.classification != Id:
+        token = self.tokens[self.pos]
+        if token.classification != Id:
             raise ValueError(
-                'error in parsing: expected an identifier but got {}'.format(self.lexer.current_token.value))
+                'error in parsing: expected an identifier but got {}'.format(token.value))
         else:
-            variable_ast = VariableExprAst(None, self.lexer.current_token.value)
-            self.lexer.next_token()
+            variable_ast = VariableExprAst(None, token.value)
+            self.pos += 1
             return variable_ast
 
     def parse_unary_expression(self, parent: 'None') -> 'throws ValueError':
@@ -105,15 +109,15 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: UnaryExprAst if no error, otherwise it will throw ValueError
         """
-        if self.lexer.current_token.value in unary_operator:
-            op = self.lexer.current_token.value
-            self.lexer.next_token()  # eat operator
+        op = self.tokens[self.pos].value
+        if op in unary_operator:
+            self.pos += 1  # eat operator
             operand = self.parse_term(None) # self.parse_expression(None, min_priority=101)
             unary_ast = UnaryExprAst(None, op, operand)
             return unary_ast
         else:
             raise ValueError(
-                'error in parsing: expected an unary operator but got {}'.format(self.lexer.current_token.value))
+                'error in parsing: expected an unary operator but got {}'.format(op))
 
     def parse_identifier_expression(self, parent: 'None') -> 'throws ValueError':
         """
@@ -123,20 +127,28 @@ class Parser:
         :return: CallExprAst if a function call is detected, VariableExprAst if the identifier reference is detected
         or throws ValueError if token mismatch
         """
-        identifier = match(Id, self.lexer)
-        if self.lexer.current_token.value == '(':
+        tokens = self.tokens
+        token = tokens[self.pos]
+        # match(Id, self) inlined, this runs for every identifier in every expression
+        if token.classification != Id:
+            raise ValueError('Token mismatch, expected: {}, got: {}'.format(Id, token.value))
+        identifier = token.value
+        self.pos += 1
+        if tokens[self.pos].value == '(':
             # function call
-            self.lexer.next_token()  # eat (
+            self.pos += 1  # eat (
             args = []
-            while self.lexer.current_token.value != ')':
-                arg_name = match(Id, self.lexer)
-                match_val(':', self.lexer)
-                arg_val = self.parse_expression(None)
-                args.append((arg_name, arg_val))
-                if self.lexer.current_token.value == ',':
-                    self.lexer.next_token()
-
-            self.lexer.next_token()  # eat )
+            append_arg = args.append
+            parse_expression = self.parse_expression
+            while tokens[self.pos].value != ')':
+                arg_name = match(Id, self)
+                match_val(':', self)
+                arg_val = parse_expression(None)
+                append_arg((arg_name, arg_val))
+                if tokens[self.pos].value == ',':
+                    self.pos += 1
+
+            self.pos += 1  # eat )
 
             return CallExprAst(None, identifier, args)
         else:
@@ -152,19 +164,20 @@ class Parser:
         :return: NumberExprAst | ExprAst | CallExprAst | VariableExprAst | UnaryExprAst depending on the routine
         or throws ValueError if there's an error
         """
-        if self.lexer.current_token.classification == Num:
+        token = self.tokens[self.pos]
+        if token.classification == Num:
             return self.parse_number_expression(parent)
-        elif self.lexer.current_token.classification == Id:
+        elif token.classification == Id:
             return self.parse_identifier_expression(parent)
-        elif self.lexer.current_token.value == '(':
-            self.lexer.next_token()  # eat (
+        elif token.value == '(':
+            self.pos += 1  # eat (
             expr_ast = self.parse_expression(None)
-            match_val(')', self.lexer)
+            match_val(')', self)
             return expr_ast
-        elif self.lexer.current_token.value in unary_operator:
+        elif token.value in unary_operator:
             return self.parse_unary_expression(None)
         else:
-            raise ValueError('error in parsing: expected term, got: {}'.format(self.lexer.current_token.value))
+            raise ValueError('error in parsing: expected term, got: {}'.format(token.value))
 
     def parse_expression(self, parent, min_priority: 'Int' = 0) -> 'throws ValueError':
         """
@@ -188,45 +201,42 @@ class Parser:
         :param min_precedence: the minimum precedence that this function can parse,
         if the precedence of the next operator is lower than the min_precedence, then this function would return
         if the precedence of the next operator is higher than the min_precedence,
-        then the function will be recursively called in order to generate the AST according to the precedence
+        then the operators are kept on a stack until their right hand sides are complete according to the precedence
         :return: BinaryExprAst if no error, or will throw ValueError if there's an error
         """
-        while self.lexer.current_token.value in operators: 
-            operator_priority = operator_precedence.get(self.lexer.current_token.value)
-            if operator_priority is None:
-                raise ValueError('error in parsing: unknown operator')
+        tokens = self.tokens
+        parse_term = self.parse_term
+        # the operators waiting for their right hand sides, [(left hand side, operator, precedence)],
+        # instead of a recursive call for each operator binding tighter than the one before it
+        stack = []
+        token = tokens[self.pos]
+        while token.precedence is not None:
+            operator_priority = token.precedence
             if operator_priority < min_precedence:
                 # if the next operator precedence is less than min_precedence, then this function should return,
                 # leaving the next operator to the upper level function to parse. 
                 # this is necessary because parse_unary_expression requires this
                 break
+            # the operators on the stack with a higher precedence complete their right hand side now,
+            # so do the ones with the same precedence, since the operators are left-associative, except =
+            # = is right-associative, the current right hand side is bound to the next = as the left hand side
+            while stack and (stack[-1][2] > operator_priority or
+                             stack[-1][2] == operator_priority and stack[-1][1] != '='):
+                left, left_op, _ = stack.pop()
+                lhs = BinaryExprAst(None, left_op, left, lhs)
+            stack.append((lhs, token.value, operator_priority))
+            self.pos += 1  # eat operator
+            lhs = parse_term(None)  # parse the right hand side, it may be the left hand side of the next operator
+            token = tokens[self.pos]
+        else:
+            # an operator without precedence, i.e. the unary operator ! or ~
+            # it ends the expression when exactly one operator is waiting, like the recursive version did
+            if token.value in operators and len(stack) != 1:
+                raise ValueError('error in parsing: unknown operator')
 
-            op = self.lexer.current_token.value
-            self.lexer.next_token()  # eat operator
-            rhs = self.parse_term(None)  # parse the right hand side, it may be the left hand side of the next operator
-            next_operator_priority = operator_precedence.get(self.lexer.current_token.value)
-            if next_operator_priority is None:
-                expr_ast = BinaryExprAst(None, op, lhs, rhs)  # complete parsing
-                return expr_ast
-            if op != '=': 
-                # the priority check is not actually necessary since we already have it above. 
-                # but this reduces the recursion layer by 1. 
-                if next_operator_priority > operator_priority:
-                    # left-associative operator
-                    # if the next precedence is larger than the current precedence,
-                    # the current right hand side should be bound to the next operator as the left hand side
-                    rhs = self.parse_expression_tail(None, rhs, operator_priority + 1)
-            else: 
-                # the priority check is not necessary, we already have it. 
-                if next_operator_priority >= operator_priority:
-                    # right-associative operator
-                    # if the next precedence is larger than OR EQUAL TO the current precedence,
-                    # the current right hand side should be bound to the next operator as the left hand side
-                    # it is important that the minimum priority is actually the operator_priority, 
-                    # otherwise it will be terminated by the operator precedence check above. 
-                    rhs = self.parse_expression_tail(None, rhs, operator_priority)
-            lhs = BinaryExprAst(None, op, lhs, rhs)
-
+        while stack:
+            left, left_op, _ = stack.pop()
+            lhs = BinaryExprAst(None, left_op, left, lhs)
         return lhs
 
         # below is the tail recursion version. 
@@ -285,13 +295,13 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: VariableDeclarationAst if no error, or throws ValueError if there's an error
         """
-        match(Var, self.lexer)
-        name = match(Id, self.lexer)
-        match_val(':', self.lexer)
-        if self.lexer.current_token.value not in types:
-            raise ValueError('error in parsing: expecting type, got {}'.format(self.lexer.current_token.value))
-        var_type = self.lexer.current_token.value
-        self.lexer.next_token()  # eat type
+        match(Var, self)
+        name = match(Id, self)
+        match_val(':', self)
+        var_type = self.tokens[self.pos].value
+        if var_type not in types:
+            raise ValueError('error in parsing: expecting type, got {}'.format(var_type))
+        self.pos += 1  # eat type
         # if self.lexer.current_token.value == '[':
         #     array_size = int(match(Num, self.lexer))
         #     match_val(']', self.lexer)
@@ -305,14 +315,14 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: IfStatementAst if there's no error, or throws ValueError if there's an error
         """
-        match(If, self.lexer)
-        match_val('(', self.lexer)
+        match(If, self)
+        match_val('(', self)
         condition = self.parse_expression(None)
-        match_val(')', self.lexer)
+        match_val(')', self)
         then_block = self.parse_statement(None)
-        if self.lexer.current_token.classification != Else:
+        if self.tokens[self.pos].classification != Else:
             return IfStatementAst(None, condition, then_block, None)
-        self.lexer.next_token()  # eat else
+        self.pos += 1  # eat else
         else_block = self.parse_statement(None)
         return IfStatementAst(None, condition, then_block, else_block)
 
@@ -323,45 +333,53 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: WhileStatementAst if there's no error, or throws ValueError if there's an error
         """
-        match(While, self.lexer)
-        match_val('(', self.lexer)
+        match(While, self)
+        match_val('(', self)
         condition = self.parse_expression(None)
-        match_val(')', self.lexer)
+        match_val(')', self)
         loop_block = self.parse_statement(None)
         return WhileStatementAst(None, condition, loop_block)
 
+    def parse_return_statement(self, parent: 'None') -> 'throws ValueError':
+        """
+        return_statement ::= 'return' expression
+        Parse the return statement
+        :param parent: should be the parent of the generated AST node, but currently not used
+        :return: ReturnStatementAst if there's no error, or throws ValueError if there's an error
+        """
+        match(Return, self)
+        value = self.parse_expression(None)
+        return ReturnStatementAst(None, value)
+
     def parse_statement(self, parent: 'None') -> 'throws ValueError':
         """
         statement ::= if_statement | while_statement | '{' {statement}* '}' | return_statement | 'pass' | expression
         Parse statement, including if, while, statement block, return, pass, and expression
         Note that an assignment is also an expression
         :param parent: should be the parent of the generated AST node, but not used currently
-        :return: StatementAst, which contains a list of statements, or throws ValueError if there's an error
+        :return: StatementAst for a statement block, the statement's own AST otherwise,
+        or throws ValueError if there's an error
         """
-        statements = []
-        if self.lexer.current_token.classification == If:
-            statement = self.parse_if_statement(None)
-            statements.append(statement)
-            return StatementAst(None, statements)
-        elif self.lexer.current_token.classification == While:
-            statement = self.parse_while_statement(None)
-            statements.append(statement)
-            return StatementAst(None, statements)
-        elif self.lexer.current_token.value == '{':
-            self.lexer.next_token()  # eat {
-            while self.lexer.current_token.value != '}':
+        tokens = self.tokens
+        token = tokens[self.pos]
+        statement_parser = statement_parsers.get(token.classification)
+        if statement_parser is not None:
+            # if, while and return statements, returned as they are,
+            # only a block needs a StatementAst to hold its list of statements
+            return statement_parser(self, None)
+        elif token.value == '{':
+            self.pos += 1  # eat {
+            statements = []
+            append_statement = statements.append
+            parse_statement = self.parse_statement
+            while tokens[self.pos].value != '}':
                 # print(self.lexer.current_token.value)
-                statement = self.parse_statement(None)
-                statements.append(statement)
-            self.lexer.next_token()  # eat }
+                statement = parse_statement(None)
+                append_statement(statement)
+            self.pos += 1  # eat }
             return StatementAst(None, statements)
-        elif self.lexer.current_token.classification == Return:
-            self.lexer.next_token()  # eat return
-            value = self.parse_expression(None)
-            statements.append(ReturnStatementAst(None, value))
-            return StatementAst(None, statements)
-        elif self.lexer.current_token.classification == Pass:
-            self.lexer.next_token()  # eat pass
+        elif token.classification == Pass:
+            self.pos += 1  # eat pass
             return None
         else:
             return self.parse_expression(None)
@@ -373,30 +391,32 @@ class Parser:
         :param parent: should be the parent of the generated node, but currently not used
         :return: FunctionDeclarationAst if no error, or throws ValueError if there's an error
         """
-        match(Func, self.lexer)
-        name = match(Id, self.lexer)
-        match_val('(', self.lexer)
+        tokens = self.tokens
+        match(Func, self)
+        name = match(Id, self)
+        match_val('(', self)
         args = []  # [ (arg_name, arg_type) ]
-        while self.lexer.current_token.value != ')':
-            arg_name = match(Id, self.lexer)
-            match_val(':', self.lexer)
-            if self.lexer.current_token.value in types:
-                arg_type = self.lexer.current_token.value
-                self.lexer.next_token()
-                args.append((arg_name, arg_type))
+        append_arg = args.append
+        while tokens[self.pos].value != ')':
+            arg_name = match(Id, self)
+            match_val(':', self)
+            arg_type = tokens[self.pos].value
+            if arg_type in types:
+                self.pos += 1
+                append_arg((arg_name, arg_type))
             else:
                 raise ValueError('unrecognized type')
-            if self.lexer.current_token.value == ',':
-                self.lexer.next_token()  # eat ,
-        self.lexer.next_token()  # eat )
-        match_val(':', self.lexer)
-        if self.lexer.current_token.value not in types:
+            if tokens[self.pos].value == ',':
+                self.pos += 1  # eat ,
+        self.pos += 1  # eat )
+        match_val(':', self)
+        return_type = tokens[self.pos].value
+        if return_type not in types:
             raise ValueError('unrecognized type')
-        return_type = self.lexer.current_token.value
-        self.lexer.next_token()
-        match_val('{', self.lexer)
+        self.pos += 1
+        match_val('{', self)
         function_body = self.parse_body_declaration(None)
-        match_val('}', self.lexer)
+        match_val('}', self)
         return FunctionDeclarationAst(None, name, args, return_type, function_body)
 
     def parse_body_declaration(self, parent: 'None') -> 'throws ValueError':
@@ -406,15 +426,21 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: FunctionBodyAst if there's no error, or throws ValueError if there's an error
         """
+        tokens = self.tokens
         var_decl = []
         statements = []
-        while self.lexer.current_token.classification == Var:
-            var_ast = self.parse_variable_declaration(None)
-            var_decl.append(var_ast)
-
-        while self.lexer.current_token.value != '}':
-            statement = self.parse_statement(None)
-            statements.append(statement)
+        # bound once, the loops below run once per declaration and statement
+        append_var = var_decl.append
+        append_statement = statements.append
+        parse_variable_declaration = self.parse_variable_declaration
+        parse_statement = self.parse_statement
+        while tokens[self.pos].classification == Var:
+            var_ast = parse_variable_declaration(None)
+            append_var(var_ast)
+
+        while tokens[self.pos].value != '}':
+            statement = parse_statement(None)
+            append_statement(statement)
 
         return FunctionBodyAst(None, var_decl, statements)
 
@@ -426,16 +452,21 @@ class Parser:
         :param parent: should be the parent of the generated AST node, but currently not used
         :return: GlobalDeclarationAst if no error, or throws ValueError if there's an error
         """
+        tokens = self.tokens
         var_decl = []
         func_decl = []
-        while self.lexer.current_token is not None and self.lexer.current_token.classification == Var:
+        append_var = var_decl.append
+        append_func = func_decl.append
+        parse_variable_declaration = self.parse_variable_declaration
+        parse_function_declaration = self.parse_function_declaration
+        while tokens[self.pos].classification == Var:
             # print('var')
-            var_ast = self.parse_variable_declaration(None)
-            var_decl.append(var_ast)
+            var_ast = parse_variable_declaration(None)
+            append_var(var_ast)
 
-        while self.lexer.current_token is not None:
-            func_ast = self.parse_function_declaration(None)
-            func_decl.append(func_ast)
+        while tokens[self.pos] is not end_token:
+            func_ast = parse_function_declaration(None)
+            append_func(func_ast)
 
         return GlobalDeclarationAst(None, var_decl, func_decl)
 
@@ -445,11 +476,25 @@ class Parser:
         This is the entry of the parser
         :return: GlobalDeclarationAst if no error, or throws ValueError if there's an error
         """
+        self.tokens = self.lexer.lex_all()
+        self.tokens.append(end_token)
+        self.pos = 0
         return self.parse_global_declaration(None)
 
 
+'''
+the parsers of the statements beginning with a keyword, by the classification of the keyword
+parse_statement looks the parser up once instead of comparing the token with each keyword
+'''
+statement_parsers = {
+    If: Parser.parse_if_statement,
+    While: Parser.parse_while_statement,
+    Return: Parser.parse_return_statement
+}
+
+
 if __name__ == '__main__':
-    file = open('test_parser.txt', 'r')
+    file = open('test_parser.txt', 'rb')
     lex = Lexer(file)
     parser = Parser(lex)
     ast = parser.parse_program()
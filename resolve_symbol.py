@@ -32,6 +32,7 @@ class FunctionSymbol(Symbol):
         super(FunctionSymbol, self).__init__(name)
         self.args = args  # function arguments
         self.return_type = return_type
+        self.is_global = True  # functions are always global
 
     def __str__(self):
         string = self.name
@@ -128,130 +129,205 @@ def check_function_definition(current_ast):
         pass
 
 
+def _check_binary_expression(work, current_ast, current_symbol_table):
+    """
+    for BinaryExprAst, just checks its LHS and RHS
+    """
+    # the work stack is last in first out, so the children are scheduled in the reversed order
+    work.append(current_ast.rhs)
+    work.append(current_ast.lhs)
+    pass
+
+
+def _check_unary_expression(work, current_ast, current_symbol_table):
+    """
+    for UnaryExprAst, just checks its operand
+    """
+    work.append(current_ast.operand)
+    pass
+
+
+def _check_call_expression(work, current_ast, current_symbol_table):
+    """
+    for CallExprAst, checks the callee is defined and the arguments match the function definition
+    """
+    callee = current_ast.callee
+    symbol_table_ptr = current_symbol_table
+    # find the symbol definition, if it's not defined in the current context, find in the upper context
+    while callee not in symbol_table_ptr.symbols:
+        if symbol_table_ptr.parent is None:  # only the global symbol table has no parent
+            raise ValueError('semantic error: function ({}) is not defined'.format(callee))
+        else:
+            symbol_table_ptr = symbol_table_ptr.parent
+
+    symbol = symbol_table_ptr.symbols[callee]
+    current_ast.args.sort()  # also sort the arguments to match the order of the function argument definition
+    args = current_ast.args
+    if len(args) != len(symbol.args):
+        raise ValueError('semantic error: '
+                         'function {} requires {} arguments, '
+                         'but {} arguments are provided'.format(callee, len(symbol.args), len(args)))
+
+    i = 0
+    # checks the argument names
+    while i < len(args):
+        if args[i][0] != symbol.args[i][0]:
+            raise ValueError('semantic error: unknown argument: {}'.format(args[i][0]))
+        i += 1
+    symbol.referenced += 1
+    # the argument values are checked like any other expression
+    for arg_name, arg_val in reversed(args):
+        work.append(arg_val)
+    pass
+
+
+def _check_variable_expression(work, current_ast, current_symbol_table):
+    """
+    for VariableExprAst, checks the variable is defined
+    """
+    symbol_table_ptr = current_symbol_table
+    # find the symbol definition, if not in current context, find in the upper context
+    while current_ast.name not in symbol_table_ptr.symbols:
+        if symbol_table_ptr.parent is None:  # only the global symbol table has no parent
+            raise ValueError('semantic error: variable ({}) is not defined'.format(current_ast.name))
+        else:
+            symbol_table_ptr = symbol_table_ptr.parent
+
+    symbol = symbol_table_ptr.symbols[current_ast.name]
+    symbol.referenced += 1
+    current_ast.symbol = symbol  # so the code generator doesn't need to find the symbol again
+    pass
+
+
+def _check_variable_declaration(work, current_ast, current_symbol_table):
+    """
+    for VariableDeclarationAst, adds the variable symbol to the current symbol table
+    """
+    if current_ast.name in current_symbol_table.symbols:
+        raise ValueError('semantic error: redefinition of variable: {}'.format(current_ast.name))
+
+    # we should add variable symbols to the current symbol table when we see a variable declaration
+    current_symbol_table.symbols[current_ast.name] = \
+        VariableSymbol(name=current_ast.name,
+                       var_type=current_ast.type,
+                       is_global=isinstance(current_symbol_table, GlobalSymbolTable))
+    pass
+
+
+def _check_function_declaration(work, current_ast, current_symbol_table):
+    """
+    for FunctionDeclarationAst, adds the arguments to the function's local symbol table and checks the body
+    """
+    if not isinstance(current_symbol_table, GlobalSymbolTable):
+        raise ValueError('unknown error: function declaration must be in global scope, this is an expected error, '
+                         'feel free to report this error to ou2@ualerta.ca')
+
+    # the function symbol has been added to the symbol table
+    local_symbol_table = current_symbol_table.children[current_ast.name]
+    # add the arguments to the function's local symbol table
+    for arg in current_ast.args:
+        local_symbol_table.symbols[arg[0]] = VariableSymbol(name=arg[0], var_type=arg[1], is_global=False)
+
+    # the body is checked in the function's local context, then the context switches back
+    work.append(current_symbol_table)
+    work.append(current_ast.body)
+    work.append(local_symbol_table)
+    pass
+
+
+def _check_return_statement(work, current_ast, current_symbol_table):
+    work.append(current_ast.value)
+    pass
+
+
+def _check_if_statement(work, current_ast, current_symbol_table):
+    work.append(current_ast.else_block)
+    work.append(current_ast.then_block)
+    work.append(current_ast.condition)
+    pass
+
+
+def _check_while_statement(work, current_ast, current_symbol_table):
+    work.append(current_ast.loop_block)
+    work.append(current_ast.condition)
+    pass
+
+
+def _check_statement(work, current_ast, current_symbol_table):
+    for statement in reversed(current_ast.statements):
+        work.append(statement)
+    pass
+
+
+def _check_function_body(work, current_ast, current_symbol_table):
+    # the variable declarations must be checked before the statements referencing them,
+    # they have no children, so they are checked right away rather than scheduled on the work stack
+    for var_ast in current_ast.var_declaration:
+        _check_variable_declaration(work, var_ast, current_symbol_table)
+
+    for statement in reversed(current_ast.statements):
+        work.append(statement)
+    pass
+
+
+def _check_global_declaration(work, current_ast, current_symbol_table):
+    for var_ast in current_ast.var_declaration:
+        _check_variable_declaration(work, var_ast, current_symbol_table)
+
+    for func_ast in reversed(current_ast.func_declaration):
+        work.append(func_ast)
+    pass
+
+
+'''
+the symbol checker of each type of AST node
+the dispatch is a single dictionary lookup on the exact type of the node,
+nodes without symbols (e.g. NumberExprAst, or None for an empty else block) have nothing to check
+'''
+symbol_checkers = {
+    BinaryExprAst: _check_binary_expression,
+    UnaryExprAst: _check_unary_expression,
+    CallExprAst: _check_call_expression,
+    VariableExprAst: _check_variable_expression,
+    VariableDeclarationAst: _check_variable_declaration,
+    FunctionDeclarationAst: _check_function_declaration,
+    ReturnStatementAst: _check_return_statement,
+    IfStatementAst: _check_if_statement,
+    WhileStatementAst: _check_while_statement,
+    StatementAst: _check_statement,
+    FunctionBodyAst: _check_function_body,
+    GlobalDeclarationAst: _check_global_declaration
+}
+
+
 def check_symbol_definition(current_ast, current_symbol_table):
     """
     checks all of the symbol definitions and references
     if a symbol is referenced before definition, it will prompt an error
     function is an exception, it supports function call before definition
+    the AST is traversed with an explicit work stack instead of recursion, so deeply nested code won't hit the
+    recursion limit. each entry of the work stack is one of:
+        an AST node: run its symbol checker, which may schedule its children
+        a symbol table: the following nodes are checked in the context of this symbol table
+    the nodes are checked in the same order as the recursion, the checkers schedule the children in the reversed order
     :param current_ast: the current AST node
     :param current_symbol_table: the symbol table of the current context
     :return: None
     """
-    if current_ast is None:
-        return
-    if isinstance(current_ast, BinaryExprAst):
-        """
-        for BinaryExprAst, just recursively checks its LHS and RHS
-        """
-        check_symbol_definition(current_ast.lhs, current_symbol_table)
-        check_symbol_definition(current_ast.rhs, current_symbol_table)
-        pass
-    elif isinstance(current_ast, UnaryExprAst):
-        """
-        for UnaryExprAst, just recursively checks its operand
-        """
-        check_symbol_definition(current_ast.operand, current_symbol_table)
-        pass
-    elif isinstance(current_ast, CallExprAst):
-        callee = current_ast.callee
-        symbol_table_ptr = current_symbol_table
-        # find the symbol definition, if it's not defined in the current context, find in the upper context
-        while callee not in symbol_table_ptr.symbols:
-            if isinstance(symbol_table_ptr, GlobalSymbolTable):
-                raise ValueError('semantic error: function ({}) is not defined'.format(callee))
-            else:
-                symbol_table_ptr = symbol_table_ptr.parent
-
-        symbol = symbol_table_ptr.symbols[callee]
-        current_ast.args.sort()  # also sort the arguments to match the order of the function argument definition
-        args = current_ast.args
-        if len(args) != len(symbol.args):
-            raise ValueError('semantic error: '
-                             'function {} requires {} arguments, '
-                             'but {} arguments are provided'.format(callee, len(symbol.args), len(args)))
-
-        i = 0
-        # checks the argument names
-        while i < len(args):
-            if args[i][0] != symbol.args[i][0]:
-                raise ValueError('semantic error: unknown argument: {}'.format(args[i][0]))
-            i += 1
-        symbol.referenced += 1
-        pass
-    elif isinstance(current_ast, VariableExprAst):
-        symbol_table_ptr = current_symbol_table
-        # find the symbol definition, if not in current context, find in the upper context
-        while current_ast.name not in symbol_table_ptr.symbols:
-            if isinstance(symbol_table_ptr, GlobalSymbolTable):
-                raise ValueError('semantic error: variable ({}) is not defined'.format(current_ast.name))
-            else:
-                symbol_table_ptr = symbol_table_ptr.parent
-
-        symbol_table_ptr.symbols[current_ast.name].referenced += 1
-        pass
-    elif isinstance(current_ast, NumberExprAst):
-        # nothing to do
-        pass
-    elif isinstance(current_ast, VariableDeclarationAst):
-        if current_ast.name in current_symbol_table.symbols:
-            raise ValueError('semantic error: redefinition of variable: {}'.format(current_ast.name))
-
-        # we should add variable symbols to the current symbol table when we see a variable declaration
-        current_symbol_table.symbols[current_ast.name] = \
-            VariableSymbol(name=current_ast.name,
-                           var_type=current_ast.type,
-                           is_global=isinstance(current_symbol_table, GlobalSymbolTable))
-        pass
-    elif isinstance(current_ast, FunctionDeclarationAst):
-        if not isinstance(current_symbol_table, GlobalSymbolTable):
-            raise ValueError('unknown error: function declaration must be in global scope, this is an expected error, '
-                             'feel free to report this error to ou2@ualerta.ca')
-
-        # the function symbol has been added to the symbol table
-        local_symbol_table = current_symbol_table.children[current_ast.name]
-        # add the arguments to the function's local symbol table
-        for arg in current_ast.args:
-            local_symbol_table.symbols[arg[0]] = VariableSymbol(name=arg[0], var_type=arg[1], is_global=False)
-
-        check_symbol_definition(current_ast.body, current_symbol_table.children[current_ast.name])
-        pass
-    elif isinstance(current_ast, ReturnStatementAst):
-        check_symbol_definition(current_ast.value, current_symbol_table)
-        pass
-    elif isinstance(current_ast, IfStatementAst):
-        check_symbol_definition(current_ast.condition, current_symbol_table)
-        check_symbol_definition(current_ast.then_block, current_symbol_table)
-        check_symbol_definition(current_ast.else_block, current_symbol_table)
-        pass
-    elif isinstance(current_ast, WhileStatementAst):
-        check_symbol_definition(current_ast.condition, current_symbol_table)
-        check_symbol_definition(current_ast.loop_block, current_symbol_table)
-        pass
-    elif isinstance(current_ast, StatementAst):
-        for statement in current_ast.statements:
-            check_symbol_definition(statement, current_symbol_table)
-        pass
-    elif isinstance(current_ast, FunctionBodyAst):
-        for var_ast in current_ast.var_declaration:
-            check_symbol_definition(var_ast, current_symbol_table)
-
-        for statement in current_ast.statements:
-            check_symbol_definition(statement, current_symbol_table)
-        pass
-    elif isinstance(current_ast, GlobalDeclarationAst):
-        for var_ast in current_ast.var_declaration:
-            check_symbol_definition(var_ast, current_symbol_table)
-
-        for func_ast in current_ast.func_declaration:
-            check_symbol_definition(func_ast, current_symbol_table)
-        pass
-    else:
-        pass
+    work = [current_ast]
+    pop_work = work.pop
+    while work:
+        current_ast = pop_work()
+        symbol_checker = symbol_checkers.get(type(current_ast))
+        if symbol_checker is not None:
+            symbol_checker(work, current_ast, current_symbol_table)
+        elif isinstance(current_ast, SymbolTable):
+            current_symbol_table = current_ast
 
 
 # tests for the functions above
 if __name__ == '__main__':
-    file = open('test_parser.txt', 'r')
+    file = open('test_parser.txt', 'rb')
     lex = Lexer(file)
     parser = Parser(lex)
     ast = parser.parse_program()
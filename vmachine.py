@@ -5,20 +5,26 @@ This file contains the definition of the virtual machine
 and provides functions to run the virtual machine code and print the virtual machine code
 """
 
+import sys
+
 # memory size of each segment
 segment_size = 8192
+# initial memory size of the text segment, the code generator doubles it whenever it runs out of space
+text_segment_size = 1024
 
 '''
 the simulated memory
-pre-allocate to segment_size integers 
+pre-allocate to segment_size integers, the text segment starts with text_segment_size integers and grows on demand 
 each integer will be an instruction or data
 we use Harvard structure, each segment has a different memory block. 
 pointers pointing to three memory segments 
 .text stores the code representation
 stack pointer stores the bottom of the stack
 .data stores the data for global variables 
+the segments are lists instead of typed arrays (e.g. array.array('q')) 
+because the integers of our language, and so the immediates in the instructions, have infinite precision 
 '''
-text_seg = [0] * segment_size
+text_seg = [0] * text_segment_size
 stack_seg = [0] * segment_size
 data_seg = [0] * segment_size
 
@@ -78,20 +84,24 @@ def gen_lea(reg0, reg1, imm):
     return encoding
 
 
-def do_lea(encoding):
+def _decode_lea(encoding):
     reg0 = (encoding >> 16) & 0xFF
     reg1 = (encoding >> 24) & 0xFF
     imm = (encoding >> 32)
+    return reg0, reg1, imm
+
+
+def do_lea(operands):
+    reg0, reg1, imm = operands
     reg_file[reg0] = reg_file[reg1] + imm
     return
 
 
-def _print_lea(encoding):
+def _format_lea(encoding):
     reg0 = (encoding >> 16) & 0xFF
     reg1 = (encoding >> 24) & 0xFF
     imm = (encoding >> 32)
-    print('lea {}, {}({})'.format(reg_names[reg0], imm, reg_names[reg1]))
-    return
+    return f'lea {reg_names[reg0]}, {imm}({reg_names[reg1]})'
 
 
 '''
@@ -109,16 +119,20 @@ def gen_jmp(addr):
     return encoding
 
 
-def do_jmp(encoding):
+def _decode_address(encoding):
+    # the operand of jmp, call, jz and jnz
     addr = encoding >> 16
+    return addr
+
+
+def do_jmp(addr):
     reg_file[rip] = addr
     return
 
 
-def _print_jmp(encoding):
+def _format_jmp(encoding):
     addr = encoding >> 16
-    print('jmp {}'.format(addr))
-    return
+    return f'jmp {addr}'
 
 
 '''
@@ -136,19 +150,18 @@ def gen_call(addr):
     return encoding
 
 
-def do_call(encoding):
-    addr = encoding >> 16
-    stack_seg[reg_file[rsp]] = reg_file[rip]
-    reg_file[rsp] = reg_file[rsp] + 1
+def do_call(addr):
+    top = reg_file[rsp]
+    stack_seg[top] = reg_file[rip]
+    reg_file[rsp] = top + 1
     reg_file[rip] = addr
 
     return
 
 
-def _print_call(encoding):
+def _format_call(encoding):
     addr = encoding >> 16
-    print('call {}'.format(addr))
-    return
+    return f'call {addr}'
 
 
 '''
@@ -174,24 +187,22 @@ def gen_jnz(addr):
     return encoding
 
 
-def do_jz(encoding):
-    addr = encoding >> 16
+def do_jz(addr):
     if reg_file[rax] == 0:
         reg_file[rip] = addr
 
 
-def do_jnz(encoding):
-    addr = encoding >> 16
+def do_jnz(addr):
     if reg_file[rax] != 0:
         reg_file[rip] = addr
 
 
-def _print_jz(encoding):
-    print('jz {}'.format(encoding >> 16))
+def _format_jz(encoding):
+    return f'jz {encoding >> 16}'
 
 
-def _print_jnz(encoding):
-    print('jnz {}'.format(encoding >> 16))
+def _format_jnz(encoding):
+    return f'jnz {encoding >> 16}'
 
 
 '''
@@ -212,23 +223,25 @@ def gen_si():
 
 
 def do_li(encoding):
-    reg_file[rsp] -= 1
-    addr = stack_seg[reg_file[rsp]]
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    addr = stack_seg[top]
     reg_file[rax] = stack_seg[addr]
 
 
 def do_si(encoding):
-    reg_file[rsp] -= 1
-    addr = stack_seg[reg_file[rsp]]
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    addr = stack_seg[top]
     stack_seg[addr] = reg_file[rax]
 
 
-def _print_li(encoding):
-    print('li')
+def _format_li(encoding):
+    return 'li'
 
 
-def _print_si(encoding):
-    print('si')
+def _format_si(encoding):
+    return 'si'
 
 
 '''
@@ -247,23 +260,25 @@ def gen_sid():
 
 
 def do_lid(encoding):
-    reg_file[rsp] = reg_file[rsp] - 1
-    addr = stack_seg[reg_file[rsp]]
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    addr = stack_seg[top]
     reg_file[rax] = data_seg[addr]
 
 
 def do_sid(encoding):
-    reg_file[rsp] = reg_file[rsp] - 1
-    addr = stack_seg[reg_file[rsp]]
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    addr = stack_seg[top]
     data_seg[addr] = reg_file[rax]
 
 
-def _print_lid(encoding):
-    print('lid')
+def _format_lid(encoding):
+    return 'lid'
 
 
-def _print_sid(encoding):
-    print('sid')
+def _format_sid(encoding):
+    return 'sid'
 
 
 '''
@@ -279,16 +294,22 @@ def gen_push(reg):
     return encoding
 
 
-def do_push(encoding):
+def _decode_register(encoding):
+    # the operand of push and pop
     reg = (encoding >> 16) & 0xFF
+    return reg
+
+
+def do_push(reg):
     # print('rsp before push: {}'.format(reg_file[rsp]))
-    stack_seg[reg_file[rsp]] = reg_file[reg]
-    reg_file[rsp] += 1
+    top = reg_file[rsp]
+    stack_seg[top] = reg_file[reg]
+    reg_file[rsp] = top + 1
 
 
-def _print_push(encoding):
+def _format_push(encoding):
     reg = (encoding >> 16) & 0xFF
-    print('push {}'.format(reg_names[reg]))
+    return f'push {reg_names[reg]}'
 
 
 '''
@@ -304,15 +325,15 @@ def gen_pop(reg):
     return encoding
 
 
-def do_pop(encoding):
-    reg = (encoding >> 16) & 0xFF
-    reg_file[rsp] -= 1
-    reg_file[reg] = stack_seg[reg_file[rsp]]
+def do_pop(reg):
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    reg_file[reg] = stack_seg[top]
 
 
-def _print_pop(encoding):
+def _format_pop(encoding):
     reg = (encoding >> 16) & 0xFF
-    print('pop {}'.format(reg_names[reg]))
+    return f'pop {reg_names[reg]}'
 
 
 '''
@@ -326,12 +347,13 @@ def gen_ret():
 
 
 def do_ret(encoding):
-    reg_file[rsp] -= 1
-    reg_file[rip] = stack_seg[reg_file[rsp]]
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    reg_file[rip] = stack_seg[top]
 
 
-def _print_ret(encoding):
-    print('ret')
+def _format_ret(encoding):
+    return 'ret'
 
 
 '''
@@ -360,12 +382,6 @@ mod = 27
 notb = 28
 
 
-def pop_from_stack():
-    reg_file[rsp] = reg_file[rsp] - 1
-    operand0 = stack_seg[reg_file[rsp]]
-    return operand0
-
-
 def gen_orb():
     return orb
 
@@ -435,37 +451,49 @@ def gen_notb():
 
 
 def do_orb(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 | operand1
 
 
 def do_xorb(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 ^ operand1
 
 
 def do_andb(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 & operand1
 
 
 def do_eq(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
-    reg_file[rax] = operand0 == operand1
+    reg_file[rax] = 1 if operand0 == operand1 else 0
 
 
 def do_ne(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
-    reg_file[rax] = operand0 != operand1
+    reg_file[rax] = 1 if operand0 != operand1 else 0
 
 
 def do_lt(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     if operand0 < operand1:
         reg_file[rax] = 1
@@ -475,137 +503,158 @@ def do_lt(encoding):
 
 
 def do_le(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
-    reg_file[rax] = operand0 <= operand1
+    reg_file[rax] = 1 if operand0 <= operand1 else 0
 
 
 def do_gt(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
-    reg_file[rax] = operand0 > operand1
+    reg_file[rax] = 1 if operand0 > operand1 else 0
 
 
 def do_ge(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
-    reg_file[rax] = operand0 >= operand1
+    reg_file[rax] = 1 if operand0 >= operand1 else 0
 
 
 def do_shl(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 << operand1
 
 
 def do_shr(encoding):
-    reg_file[rsp] = reg_file[rsp] - 1
-    operand0 = stack_seg[reg_file[rsp]]
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 >> operand1
 
 
 def do_add(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 + operand1
 
 
 def do_sub(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 - operand1
 
 
 def do_mul(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 * operand1
 
 
 def do_div(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 // operand1
 
 
 def do_mod(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     operand1 = reg_file[rax]
     reg_file[rax] = operand0 % operand1
 
 
 def do_notb(encoding):
-    operand0 = pop_from_stack()
+    top = reg_file[rsp] - 1
+    reg_file[rsp] = top
+    operand0 = stack_seg[top]
     reg_file[rax] = ~operand0
 
 
-def _print_orb(encoding):
-    print('orb')
+def _format_orb(encoding):
+    return 'orb'
 
 
-def _print_xorb(encoding):
-    print('xorb')
+def _format_xorb(encoding):
+    return 'xorb'
 
 
-def _print_andb(encoding):
-    print('andb')
+def _format_andb(encoding):
+    return 'andb'
 
 
-def _print_eq(encoding):
-    print('eq')
+def _format_eq(encoding):
+    return 'eq'
 
 
-def _print_ne(encoding):
-    print('ne')
+def _format_ne(encoding):
+    return 'ne'
 
 
-def _print_lt(encoding):
-    print('lt')
+def _format_lt(encoding):
+    return 'lt'
 
 
-def _print_le(encoding):
-    print('le')
+def _format_le(encoding):
+    return 'le'
 
 
-def _print_gt(encoding):
-    print('gt')
+def _format_gt(encoding):
+    return 'gt'
 
 
-def _print_ge(encoding):
-    print('ge')
+def _format_ge(encoding):
+    return 'ge'
 
 
-def _print_shl(encoding):
-    print('shl')
+def _format_shl(encoding):
+    return 'shl'
 
 
-def _print_shr(encoding):
-    print('shr')
+def _format_shr(encoding):
+    return 'shr'
 
 
-def _print_add(encoding):
-    print('add')
+def _format_add(encoding):
+    return 'add'
 
 
-def _print_sub(encoding):
-    print('sub')
+def _format_sub(encoding):
+    return 'sub'
 
 
-def _print_mul(encoding):
-    print('mul')
+def _format_mul(encoding):
+    return 'mul'
 
 
-def _print_div(encoding):
-    print('div')
+def _format_div(encoding):
+    return 'div'
 
 
-def _print_mod(encoding):
-    print('mod')
+def _format_mod(encoding):
+    return 'mod'
 
 
-def _print_notb(encoding):
-    print('notb')
+def _format_notb(encoding):
+    return 'notb'
 
 
 '''
@@ -628,28 +677,140 @@ def gen_iexit():
     return iexit
 
 
+'''
+the output of the outpt instructions not written yet
+the output is written by flush_output at once, when the buffer is full, before reading the input
+and when the program stops
+'''
+output_buffer = []
+output_buffer_size = 1024
+
+
+def flush_output():
+    if output_buffer:
+        output_buffer.append('')  # the last line also ends with a newline
+        sys.stdout.write('\n'.join(output_buffer))
+        output_buffer.clear()
+
+
 def do_inpt(encoding):
+    flush_output()  # the prompting output must be shown before waiting for the input
     reg_file[rax] = int(input())
 
 
 def do_outpt(encoding):
-    print(stack_seg[reg_file[rsp] - 1])
+    output_buffer.append(str(stack_seg[reg_file[rsp] - 1]))
+    if len(output_buffer) >= output_buffer_size:
+        flush_output()
 
 
 def do_iexit(encoding):
     pass
 
 
-def _print_inpt(encoding):
-    print('inpt')
+def _format_inpt(encoding):
+    return 'inpt'
+
+
+def _format_outpt(encoding):
+    return 'outpt'
 
 
-def _print_outpt(encoding):
-    print('outpt')
+def _format_iexit(encoding):
+    return 'iexit'
 
 
-def _print_iexit(encoding):
-    print('iexit')
+'''
+the handler of each instruction, indexed by the instruction type in the lower 16 bits of the encoding
+iexit has no handler, run_vm stops when it reaches iexit or an unknown instruction
+'''
+instruction_handlers = {
+    lea: do_lea,
+    jmp: do_jmp,
+    jz: do_jz,
+    jnz: do_jnz,
+    call: do_call,
+    li: do_li,
+    si: do_si,
+    lid: do_lid,
+    sid: do_sid,
+    push: do_push,
+    pop: do_pop,
+    ret: do_ret,
+    orb: do_orb,
+    xorb: do_xorb,
+    andb: do_andb,
+    eq: do_eq,
+    ne: do_ne,
+    lt: do_lt,
+    le: do_le,
+    gt: do_gt,
+    ge: do_ge,
+    shl: do_shl,
+    shr: do_shr,
+    add: do_add,
+    sub: do_sub,
+    mul: do_mul,
+    div: do_div,
+    mod: do_mod,
+    notb: do_notb,
+    inpt: do_inpt,
+    outpt: do_outpt
+}
+
+
+'''
+the operand decoder of the instructions with operands, run_vm decodes every instruction in the text segment once
+and the handler receives the decoded operands, the other handlers receive the encoding itself
+'''
+instruction_decoders = {
+    lea: _decode_lea,
+    jmp: _decode_address,
+    call: _decode_address,
+    jz: _decode_address,
+    jnz: _decode_address,
+    push: _decode_register,
+    pop: _decode_register
+}
+
+
+'''
+the formatter of each instruction, indexed by the instruction type, it returns the assembly of the instruction
+'''
+instruction_formatters = {
+    lea: _format_lea,
+    jmp: _format_jmp,
+    jz: _format_jz,
+    jnz: _format_jnz,
+    call: _format_call,
+    li: _format_li,
+    si: _format_si,
+    lid: _format_lid,
+    sid: _format_sid,
+    push: _format_push,
+    pop: _format_pop,
+    ret: _format_ret,
+    orb: _format_orb,
+    xorb: _format_xorb,
+    andb: _format_andb,
+    eq: _format_eq,
+    ne: _format_ne,
+    lt: _format_lt,
+    le: _format_le,
+    gt: _format_gt,
+    ge: _format_ge,
+    shl: _format_shl,
+    shr: _format_shr,
+    add: _format_add,
+    sub: _format_sub,
+    mul: _format_mul,
+    div: _format_div,
+    mod: _format_mod,
+    notb: _format_notb,
+    inpt: _format_inpt,
+    outpt: _format_outpt,
+    iexit: _format_iexit
+}
 
 
 def run_vm():
@@ -657,166 +818,57 @@ def run_vm():
     Run the program according to the code in the text_seg
     :return: None
     """
-    while True:
-        encoding = text_seg[reg_file[rip]]
-        reg_file[rip] += 1
+    # the handler and the decoded operands of each instruction in the text segment, prepared once before running
+    # rather than decoding every instruction executed, the handler is None for iexit and unknown instructions
+    text = text_seg
+    registers = reg_file
+    handlers = []
+    operands = []
+    for encoding in text:
         code = encoding & 0xFFFF
-        if code == lea:
-            do_lea(encoding)
-        elif code == jmp:
-            do_jmp(encoding)
-        elif code == jz:
-            do_jz(encoding)
-        elif code == jnz:
-            do_jnz(encoding)
-        elif code == call:
-            do_call(encoding)
-        elif code == li:
-            do_li(encoding)
-        elif code == si:
-            do_si(encoding)
-        elif code == lid:
-            do_lid(encoding)
-        elif code == sid:
-            do_sid(encoding)
-        elif code == push:
-            do_push(encoding)
-        elif code == pop:
-            do_pop(encoding)
-        elif code == ret:
-            do_ret(encoding)
-        elif code == orb:
-            do_orb(encoding)
-        elif code == xorb:
-            do_xorb(encoding)
-        elif code == andb:
-            do_andb(encoding)
-        elif code == eq:
-            do_eq(encoding)
-        elif code == ne:
-            do_ne(encoding)
-        elif code == lt:
-            do_lt(encoding)
-        elif code == le:
-            do_le(encoding)
-        elif code == gt:
-            do_gt(encoding)
-        elif code == ge:
-            do_ge(encoding)
-        elif code == shl:
-            do_shl(encoding)
-        elif code == shr:
-            do_shr(encoding)
-        elif code == add:
-            do_add(encoding)
-        elif code == sub:
-            do_sub(encoding)
-        elif code == mul:
-            do_mul(encoding)
-        elif code == div:
-            do_div(encoding)
-        elif code == mod:
-            do_mod(encoding)
-        elif code == notb:
-            do_notb(encoding)
-        elif code == inpt:
-            do_inpt(encoding)
-        elif code == outpt:
-            do_outpt(encoding)
-        elif code == iexit:
-            print('program exited')
-            break
-        else:
-            print('unknown instruction: {}'.format(code))
-            break
+        handlers.append(instruction_handlers.get(code))
+        decoder = instruction_decoders.get(code)
+        operands.append(encoding if decoder is None else decoder(encoding))
+    try:
+        while True:
+            pc = registers[rip]
+            registers[rip] = pc + 1
+            handler = handlers[pc]
+            if handler is None:
+                break
+            handler(operands[pc])
+    finally:
+        # the buffered output is written even if the program stops with an error
+        flush_output()
+    code = text[pc] & 0xFFFF
+    if code == iexit:
+        print('program exited')
+    else:
+        print('unknown instruction: {}'.format(code))
 
 
 def print_text():
     """
     Prints the assembly in text_seg
+    the lines are collected and written at once rather than printed one by one
     :return: None
     """
+    lines = []
     line = 0
     for i in text_seg:
-        print(line, end='\t')
         encoding = i
-        if isinstance(i, str):
-            # if the code is not linked, the function calls will just be the callee name itself
-            print(i)
-            line += 1
-            continue
         if i == 0:
-            print()
+            lines.append(f'{line}\t')
             break
         code = encoding & 0xFFFF
-        if code == lea:
-            _print_lea(encoding)
-        elif code == jmp:
-            _print_jmp(encoding)
-        elif code == jz:
-            _print_jz(encoding)
-        elif code == jnz:
-            _print_jnz(encoding)
-        elif code == call:
-            _print_call(encoding)
-        elif code == li:
-            _print_li(encoding)
-        elif code == si:
-            _print_si(encoding)
-        elif code == lid:
-            _print_lid(encoding)
-        elif code == sid:
-            _print_sid(encoding)
-        elif code == push:
-            _print_push(encoding)
-        elif code == pop:
-            _print_pop(encoding)
-        elif code == ret:
-            _print_ret(encoding)
-        elif code == orb:
-            _print_orb(encoding)
-        elif code == xorb:
-            _print_xorb(encoding)
-        elif code == andb:
-            _print_andb(encoding)
-        elif code == eq:
-            _print_eq(encoding)
-        elif code == ne:
-            _print_ne(encoding)
-        elif code == lt:
-            _print_lt(encoding)
-        elif code == le:
-            _print_le(encoding)
-        elif code == gt:
-            _print_gt(encoding)
-        elif code == ge:
-            _print_ge(encoding)
-        elif code == shl:
-            _print_shl(encoding)
-        elif code == shr:
-            _print_shr(encoding)
-        elif code == add:
-            _print_add(encoding)
-        elif code == sub:
-            _print_sub(encoding)
-        elif code == mul:
-            _print_mul(encoding)
-        elif code == div:
-            _print_div(encoding)
-        elif code == mod:
-            _print_mod(encoding)
-        elif code == notb:
-            _print_notb(encoding)
-        elif code == inpt:
-            _print_inpt(encoding)
-        elif code == outpt:
-            _print_outpt(encoding)
-        elif code == iexit:
-            _print_iexit(encoding)
+        formatter = instruction_formatters.get(code)
+        if formatter is not None:
+            lines.append(f'{line}\t{formatter(encoding)}')
         else:
-            print('unknown instruction: {}'.format(code))
+            lines.append(f'{line}\tunknown instruction: {code}')
             break
         line += 1
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 # testing the virtual machine